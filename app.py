@@ -1,10 +1,33 @@
-# 2025-12-20 17:10:00: [UI] App 介面 - 強制格式化修復 (Force Numeric Casting)
+# 2026-10-19 19:30:00: [UI] App 介面 - 各級距流量沿用籌碼表的區間 (預熱 / 歷史查詢共用)
 import streamlit as st
 import pandas as pd
-from src.database import get_latest_date, get_available_dates
-from src.logic import calculate_top_growth, get_stock_distribution_table
+from src.database import get_latest_date, get_available_dates, get_date_index, record_stock_view
+from src.logic import (
+    calculate_top_growth, calculate_concentration_shift, get_stock_distribution_table, get_stock_level_flows
+)
+from src.analytics import downsample_series
 from src.ai_analyst import generate_chip_analysis
 
+# 個股歷史區間 (None: 近 12 週；數字: 年數；'all': 全部)
+HISTORY_RANGES = {"近12週": None, "1年": 1, "3年": 3, "全部": "all"}
+CHART_MAX_POINTS = 150
+TABLE_PAGE_SIZE = 26
+
+# 側邊欄「不完整週次」提示只看近一年
+INCOMPLETE_LOOKBACK_WEEKS = 52
+
+def resolve_history_start(range_key, df_dates):
+    """將歷史區間選項轉為起始日期 (None 代表沿用近 12 週查詢)"""
+    years = HISTORY_RANGES[range_key]
+    if years is None:
+        return None
+    if years == "all":
+        if df_dates.empty:
+            st.warning("⚠️ 日期索引為空，無法判斷最早日期，改為顯示近 12 週。請先執行資料回補。")
+            return None
+        return str(df_dates['date'].iloc[-1])
+    return (pd.Timestamp.today() - pd.DateOffset(years=years)).strftime('%Y-%m-%d')
+
 st.set_page_config(
     page_title="台股籌碼戰情室",
     page_icon="📈",
@@ -23,10 +46,10 @@ def format_stock_table(df_in: pd.DataFrame):
     # 如果是 Object 型態，Styler 的 format 會失效
     target_cols = [
         '總股東數', '平均張數/人', '>400張_比例', '>400張_人數', 
-        '>1000張_比例', '>1000張_人數', '收盤價'
+        '>1000張_比例', '>1000張_人數', '收盤價', 'Gini', 'HHI', '散戶比例'
     ]
     # 包含對應的 diff 欄位
-    all_numeric_cols = target_cols + [f"{c}_diff" for c in target_cols]
+    all_numeric_cols = target_cols + [f"{c}_diff" for c in target_cols] + ['散戶流量(張)', '大戶流量(張)']
     
     for col in all_numeric_cols:
         if col in df.columns:
@@ -42,7 +65,10 @@ def format_stock_table(df_in: pd.DataFrame):
         ('>400張_人數', '>400張_人數_diff', '{:,.0f}'),
         ('>1000張_比例', '>1000張_比例_diff', '{:.2f}%'),
         ('>1000張_人數', '>1000張_人數_diff', '{:,.0f}'),
-        ('收盤價', '收盤價_diff', '{:.2f}')
+        ('收盤價', '收盤價_diff', '{:.2f}'),
+        ('Gini', 'Gini_diff', '{:.4f}'),
+        ('HHI', 'HHI_diff', '{:,.1f}'),
+        ('散戶比例', '散戶比例_diff', '{:.2f}%')
     ]
 
     for col_name, diff_col, fmt in columns_config:
@@ -61,6 +87,10 @@ def format_stock_table(df_in: pd.DataFrame):
                 axis=1
             )
 
+    # 流量本身即為週變化，僅設定格式
+    flow_cols = [c for c in ['散戶流量(張)', '大戶流量(張)'] if c in df.columns]
+    styler = styler.format({c: '{:+,.0f}' for c in flow_cols}, na_rep='')
+
     # 隱藏 _diff 欄位
     hide_cols = [c for c in df.columns if c.endswith('_diff')]
     styler = styler.hide(subset=hide_cols, axis=1)
@@ -71,6 +101,15 @@ with st.sidebar:
     st.title("⚙️ 系統控制台")
     latest_date = get_latest_date()
     st.info(f"📅 資料庫最新數據: **{latest_date}**")
+    df_date_index = get_date_index()
+    incomplete_dates = []
+    if not df_date_index.empty:
+        latest_info = df_date_index.iloc[0]
+        st.caption(f"最新一週: {latest_info['stock_count']:,} 檔 / {latest_info['row_count']:,} 筆")
+        recent_index = df_date_index.head(INCOMPLETE_LOOKBACK_WEEKS)
+        incomplete_dates = recent_index.loc[~recent_index['is_complete'], 'date'].tolist()
+    if incomplete_dates:
+        st.warning(f"⚠️ 資料可能不完整的週次: {', '.join(map(str, incomplete_dates))}")
     st.caption("Version: 1.5.0 (Format Fixed)")
 
 st.title("📊 台股籌碼資產戰情室")
@@ -84,8 +123,9 @@ with tab1:
         st.warning("⚠️ 資料庫數據不足兩週，請先執行資料回補。")
     else:
         col1, col2, col3 = st.columns([2, 2, 1])
-        with col1: date_this = st.selectbox("選擇本期", dates, index=0)
-        with col2: date_last = st.selectbox("選擇上期", dates, index=1 if len(dates)>1 else 0)
+        date_label = lambda d: f"{d} ⚠️" if d in incomplete_dates else str(d)
+        with col1: date_this = st.selectbox("選擇本期", dates, index=0, format_func=date_label)
+        with col2: date_last = st.selectbox("選擇上期", dates, index=1 if len(dates)>1 else 0, format_func=date_label)
         with col3: 
             st.write("")
             run_btn = st.button("🚀 開始計算", use_container_width=True)
@@ -94,13 +134,21 @@ with tab1:
             with st.spinner("計算中..."):
                 top_growth_df = calculate_top_growth(str(date_this), str(date_last))
                 if not top_growth_df.empty:
+                    conc_shift_df = calculate_concentration_shift(str(date_this), str(date_last), top_growth_df['股票代號'])
+                    if not conc_shift_df.empty:
+                        top_growth_df = top_growth_df.merge(conc_shift_df, on='股票代號', how='left')
                     st.dataframe(
                         top_growth_df,
                         use_container_width=True,
                         column_config={
                             "週增減%": st.column_config.NumberColumn(format="%.2f %%"),
                             "大戶持股比%": st.column_config.NumberColumn(format="%.2f %%"),
-                            "持有股數": st.column_config.ProgressColumn(format="%d", min_value=0, max_value=int(top_growth_df['持有股數'].max()))
+                            "持有股數": st.column_config.ProgressColumn(format="%d", min_value=0, max_value=int(top_growth_df['持有股數'].max())),
+                            "Gini": st.column_config.NumberColumn(format="%.4f"),
+                            "Gini_diff": st.column_config.NumberColumn("Gini 變化", format="%+.4f"),
+                            "散戶比例_diff": st.column_config.NumberColumn("散戶比例變化", format="%+.2f %%"),
+                            "散戶流量(張)": st.column_config.NumberColumn(format="%+.0f"),
+                            "大戶流量(張)": st.column_config.NumberColumn(format="%+.0f")
                         },
                         hide_index=True
                     )
@@ -112,10 +160,19 @@ with tab2:
     col_input, col_info = st.columns([1, 3])
     with col_input:
         target_stock = st.text_input("輸入股票代號", value="2330", max_chars=4)
+    with col_info:
+        history_range = st.radio("歷史區間", list(HISTORY_RANGES.keys()), horizontal=True)
     
     if target_stock and target_stock.isdigit() and len(target_stock)==4:
+        # 每個 session 每檔只記錄一次，避免 rerun 重複寫入
+        viewed = st.session_state.setdefault("viewed_stocks", set())
+        if target_stock not in viewed:
+            viewed.add(target_stock)
+            record_stock_view(target_stock)
+
         with st.spinner(f"正在撈取 {target_stock} 資料..."):
-            df_detail = get_stock_distribution_table(target_stock)
+            history_start = resolve_history_start(history_range, df_date_index)
+            df_detail = get_stock_distribution_table(target_stock, history_start)
             
             if df_detail.empty:
                 st.warning("查無資料。")
@@ -146,18 +203,31 @@ with tab2:
                 st.divider()
                 st.subheader("📊 股價 vs 千張大戶持股比")
                 chart_data = df_detail.sort_values('date', ascending=True).set_index('date')
-                st.line_chart(chart_data[['>1000張_比例', '>400張_比例']])
+                chart_data = downsample_series(chart_data[['>1000張_比例', '>400張_比例']], CHART_MAX_POINTS)
+                st.line_chart(chart_data)
+
+                # 各級距流量 (最新一週，正值為該級距淨流入)
+                df_flows = get_stock_level_flows(target_stock, history_start)
+                if not df_flows.empty:
+                    st.subheader(f"🔀 各級距持股流向 ({df_flows.iloc[0]['date']}，張)")
+                    st.bar_chart(df_flows.iloc[0].drop('date').astype(float))
                 
                 st.divider()
                 st.subheader("🤖 AI 籌碼解讀 (Claude 3.5)")
                 if st.button("⚡ 啟動 AI 智能分析"):
                     with st.spinner("連線分析中..."):
-                        analysis, debug_prompt = generate_chip_analysis(target_stock, df_detail)
+                        analysis, debug_prompt = generate_chip_analysis(target_stock, df_detail, df_flows)
                         st.markdown(analysis)
                         with st.expander("🕵️ 開發者 Prompt 除錯"):
                             st.code(debug_prompt, language='markdown')
 
                 st.divider()
                 st.subheader("📋 詳細籌碼變化表")
+                # 分頁顯示，Styler 只處理當頁資料
+                total_pages = max(1, -(-len(df_detail) // TABLE_PAGE_SIZE))
+                page = 1
+                if total_pages > 1:
+                    page = st.number_input(f"頁數 (共 {total_pages} 頁，每頁 {TABLE_PAGE_SIZE} 週)", min_value=1, max_value=total_pages, value=1)
+                df_page = df_detail.iloc[(page - 1) * TABLE_PAGE_SIZE : page * TABLE_PAGE_SIZE]
                 # 這裡傳入的已經是乾淨的 Styler
-                st.dataframe(format_stock_table(df_detail), use_container_width=True, height=500)
+                st.dataframe(format_stock_table(df_page), use_container_width=True, height=500)
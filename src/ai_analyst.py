@@ -1,4 +1,4 @@
-# 2025-12-20 14:40:00: [Refactor] AI 分析模組
+# 2026-10-19 17:00:00: [Feat] AI 分析模組 - Prompt 加入各級距流量
 import os
 import streamlit as st
 import pandas as pd
@@ -16,7 +16,7 @@ def get_anthropic_client():
         return None
     return anthropic.Anthropic(api_key=api_key)
 
-def generate_chip_analysis(stock_id: str, df: pd.DataFrame):
+def generate_chip_analysis(stock_id: str, df: pd.DataFrame, level_flows: pd.DataFrame = None):
     client = get_anthropic_client()
     if not client:
         return "⚠️ 錯誤：未設定 ANTHROPIC_API_KEY。", ""
@@ -30,18 +30,28 @@ def generate_chip_analysis(stock_id: str, df: pd.DataFrame):
         '>1000張_人數', 
         '>400張_比例', 
         '>400張_人數', 
-        '總股東數'
+        '總股東數',
+        'Gini',
+        '散戶比例',
+        '散戶流量(張)',
+        '大戶流量(張)'
     ]
     
     valid_cols = [c for c in cols_to_keep if c in recent_data.columns]
     data_str = recent_data[valid_cols].to_markdown(index=False)
 
+    # 各級距流量 (近 4 週，L1 散戶 ~ L15 千張大戶)
+    flows_str = "無"
+    if level_flows is not None and not level_flows.empty:
+        flows_str = level_flows.head(4).to_markdown(index=False, floatfmt=".0f")
+
     system_prompt = """
     你是一位專業的台股籌碼分析師。
     
     分析核心邏輯：
     1. **鎖碼判讀**：若「大戶持股比例增加」且「大戶人數減少」，代表籌碼高度集中(鎖碼)，偏多。
     2. **散戶指標**：總股東數增加通常代表籌碼渙散，偏空。
+    3. **集中度**：Gini 係數上升、散戶(50張以下)比例下降且散戶流量為負，代表籌碼由散戶流向大戶。
     
     請提供簡短、條列式的繁體中文分析報告，字數 300 字以內。
     """
@@ -50,6 +60,9 @@ def generate_chip_analysis(stock_id: str, df: pd.DataFrame):
     股票代號：{stock_id}
     近期籌碼數據 (由新到舊)：
     {data_str}
+
+    各級距持股流量 (張，正值為淨流入，L1 最小 ~ L15 千張以上)：
+    {flows_str}
     
     請開始分析。
     """
@@ -0,0 +1,393 @@
+# 2026-10-19 20:00:00: [Fix] 分析模組 - 單檔與批次股價統一還原權息設定
+import json
+import numpy as np
+import pandas as pd
+import yfinance as yf
+
+# >400張 (Level 12 ~ 15)
+BIG_HOLDER_LEVELS = [12, 13, 14, 15]
+# >1000張
+TOP_LEVEL = 15
+
+DIFF_COLUMNS = ['總股東數', '平均張數/人', '>400張_比例', '>400張_人數', '>1000張_比例', '>1000張_人數', '收盤價',
+                'Gini', 'HHI', '散戶比例']
+
+# --- 1. 市場分析 ---
+def compute_top_growth(df_this: pd.DataFrame, df_last: pd.DataFrame, top_n=20) -> pd.DataFrame:
+    """兩期 Level 15 快照比較，取千張大戶持股比增加最多的前 N 檔"""
+    if df_this.empty or df_last.empty:
+        return pd.DataFrame()
+
+    merged = pd.merge(
+        df_this[['stock_id', 'percent', 'shares']],
+        df_last[['stock_id', 'percent']],
+        on='stock_id',
+        suffixes=('_this', '_last')
+    )
+
+    merged['change_pct'] = merged['percent_this'] - merged['percent_last']
+    result = merged.sort_values('change_pct', ascending=False).head(top_n)
+
+    final_df = result[['stock_id', 'percent_this', 'change_pct', 'shares']].copy()
+    final_df.columns = ['股票代號', '大戶持股比%', '週增減%', '持有股數']
+    return final_df
+
+# --- 2. 股價 ---
+# 單檔 / 批次下載需一致 (預熱、報表與即時查詢的收盤價才會相同)，沿用 Ticker.history 預設的還原權息收盤價
+PRICE_AUTO_ADJUST = True
+
+def fetch_stock_price(stock_id: str, start_date: str, end_date: str) -> dict:
+    try:
+        ticker = f"{stock_id}.TW"
+        end_buffer = pd.to_datetime(end_date) + pd.Timedelta(days=5)
+        data = yf.Ticker(ticker).history(start=start_date, end=end_buffer, auto_adjust=PRICE_AUTO_ADJUST)
+
+        if data.empty:
+            ticker = f"{stock_id}.TWO"
+            data = yf.Ticker(ticker).history(start=start_date, end=end_buffer, auto_adjust=PRICE_AUTO_ADJUST)
+
+        if data.empty:
+            return {}
+
+        data.index = data.index.strftime('%Y-%m-%d')
+        return data['Close'].to_dict()
+    except Exception as e:
+        return {}
+
+def fetch_stock_prices_bulk(stock_ids: list, start_date: str, end_date: str) -> dict:
+    """
+    批次撈取多檔收盤價 (一次 yf.download，上市查無再以上櫃 .TWO 補查)
+    回傳: {stock_id: {date_str: close}}
+    """
+    end_buffer = pd.to_datetime(end_date) + pd.Timedelta(days=5)
+    price_maps = {}
+
+    def download_close(suffix, ids):
+        if not ids:
+            return
+        try:
+            data = yf.download(
+                [f"{sid}{suffix}" for sid in ids],
+                start=start_date, end=end_buffer,
+                progress=False, threads=True, auto_adjust=PRICE_AUTO_ADJUST
+            )
+        except Exception:
+            return
+        if data.empty:
+            return
+
+        close = data['Close']
+        if isinstance(close, pd.Series):
+            close = close.to_frame(f"{ids[0]}{suffix}")
+        close.index = close.index.strftime('%Y-%m-%d')
+
+        for sid in ids:
+            col = f"{sid}{suffix}"
+            if col in close.columns:
+                series = close[col].dropna()
+                if not series.empty:
+                    price_maps[sid] = series.to_dict()
+
+    download_close(".TW", list(stock_ids))
+    download_close(".TWO", [sid for sid in stock_ids if sid not in price_maps])
+    return price_maps
+
+# --- 3. 個股分析 ---
+def aggregate_weekly(raw_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    將原始分級資料彙整為每檔每週一列 (可一次處理多檔、多週)
+    回傳欄位: stock_id, date, 總股東數, 平均張數/人, >400張_比例, >400張_人數, >1000張_比例, >1000張_人數
+    """
+    if raw_df.empty:
+        return pd.DataFrame()
+
+    # 強制轉型
+    df = raw_df.copy()
+    for col in ['level', 'persons', 'shares', 'percent']:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+
+    # 1. 去重複 (新資料已於入庫時檢核，但既有資料仍可能有重複級距)
+    df = df.drop_duplicates(subset=['stock_id', 'date', 'level'], keep='first')
+
+    # 2. 各週彙總 (非目標 level 以 NaN 排除，sum 時視為 0；總數僅計 Level 1~15，排除差異數調整與合計列)
+    is_dist = df['level'].isin(DISTRIBUTION_LEVELS)
+    is_big = df['level'].isin(BIG_HOLDER_LEVELS)
+    is_top = df['level'] == TOP_LEVEL
+    df = df.assign(
+        dist_persons=df['persons'].where(is_dist),
+        dist_shares=df['shares'].where(is_dist),
+        big_pct=df['percent'].where(is_big),
+        big_persons=df['persons'].where(is_big),
+        top_pct=df['percent'].where(is_top),
+        top_persons=df['persons'].where(is_top),
+    )
+    agg = df.groupby(['stock_id', 'date'], sort=False).agg(
+        total_persons=('dist_persons', 'sum'),
+        total_shares=('dist_shares', 'sum'),
+        big_pct=('big_pct', 'sum'),
+        big_persons=('big_persons', 'sum'),
+        top_pct=('top_pct', 'sum'),
+        top_persons=('top_persons', 'sum'),
+    ).reset_index()
+
+    avg_shares = agg['total_shares'] / agg['total_persons'] / 1000
+    agg['avg_shares'] = avg_shares.where(agg['total_persons'] > 0, 0)
+
+    return pd.DataFrame({
+        'stock_id': agg['stock_id'],
+        'date': agg['date'].astype(str),
+        '總股東數': agg['total_persons'],
+        '平均張數/人': agg['avg_shares'],
+        '>400張_比例': agg['big_pct'],
+        '>400張_人數': agg['big_persons'],
+        '>1000張_比例': agg['top_pct'],
+        '>1000張_人數': agg['top_persons'],
+    })
+
+def build_distribution_table(raw_df: pd.DataFrame, stock_id: str) -> pd.DataFrame:
+    """
+    單一個股的每週籌碼表 (強制過濾 stock_id)
+    (不含股價與 diff，見 attach_price_and_diff)
+    """
+    clean_stock_id = str(stock_id).strip()
+    if raw_df.empty:
+        return pd.DataFrame()
+
+    stock_df = raw_df[raw_df['stock_id'] == clean_stock_id]
+    if stock_df.empty:
+        return pd.DataFrame()
+
+    return aggregate_weekly(stock_df).drop(columns=['stock_id'])
+
+def build_stock_table(raw_df: pd.DataFrame, stock_id: str) -> pd.DataFrame:
+    """個股籌碼表 + 集中度指標 (App 與快取預熱共用；股價與 diff 見 attach_price_and_diff)"""
+    clean_stock_id = str(stock_id).strip()
+    df_pivot = build_distribution_table(raw_df, clean_stock_id)
+    if df_pivot.empty:
+        return df_pivot
+
+    conc_df = compute_concentration(raw_df[raw_df['stock_id'] == clean_stock_id])
+    if not conc_df.empty:
+        conc_cols = ['gini', 'hhi', 'retail_pct', 'retail_flow', 'big_flow']
+        conc_df = conc_df[['date'] + conc_cols].rename(columns=CONCENTRATION_LABELS)
+        df_pivot = df_pivot.merge(conc_df, on='date', how='left')
+    return df_pivot
+
+def attach_price_and_diff(df_pivot: pd.DataFrame, price_map: dict = None) -> pd.DataFrame:
+    """整合收盤價並計算週變化 (_diff)，回傳由新到舊排序"""
+    if df_pivot.empty:
+        return df_pivot
+
+    df_pivot = df_pivot.copy()
+    if price_map is not None:
+        df_pivot['收盤價'] = df_pivot['date'].map(price_map)
+
+    # 計算 Diff
+    df_pivot = df_pivot.sort_values('date', ascending=True)
+    for col in DIFF_COLUMNS:
+        if col in df_pivot.columns:
+            # 不填 0，保留 NaN 給前端判定顏色 (第一筆不變色)
+            df_pivot[f'{col}_diff'] = df_pivot[col].diff()
+
+    return df_pivot.sort_values('date', ascending=False)
+
+def build_market_table(raw_df: pd.DataFrame, price_maps: dict = None) -> pd.DataFrame:
+    """
+    全市場每檔每週籌碼表 (一次向量化彙總，diff 以 stock_id 分組計算)
+    price_maps: {stock_id: {date_str: close}}，None 時不含收盤價
+    回傳依 stock_id 排序、同檔由新到舊
+    """
+    df = aggregate_weekly(raw_df)
+    if df.empty:
+        return df
+
+    if price_maps is not None:
+        prices = pd.DataFrame(
+            [(sid, d, close) for sid, price_map in price_maps.items() for d, close in price_map.items()],
+            columns=['stock_id', 'date', '收盤價']
+        )
+        df = df.merge(prices, on=['stock_id', 'date'], how='left')
+
+    # 計算 Diff (不填 0，每檔第一週保留 NaN)
+    df = df.sort_values(['stock_id', 'date'], ascending=True, ignore_index=True)
+    diff_cols = [c for c in DIFF_COLUMNS if c in df.columns]
+    diffs = df.groupby('stock_id', sort=False)[diff_cols].diff()
+    df[[f'{c}_diff' for c in diff_cols]] = diffs.to_numpy()
+
+    return df.sort_values(['stock_id', 'date'], ascending=[True, False], ignore_index=True)
+
+# --- 4. 異動標記 ---
+def flag_chip_changes(latest_df: pd.DataFrame, threshold: float = 0.5) -> pd.DataFrame:
+    """
+    依最新一週變化標記籌碼異動 (輸入需含 stock_id 與 _diff 欄位)：
+    - 鎖碼: 千張大戶比例增加 >= threshold 且 總股東數減少
+    - 渙散: 千張大戶比例減少 >= threshold 且 總股東數增加
+    """
+    if latest_df.empty:
+        return pd.DataFrame()
+
+    pct_diff = latest_df['>1000張_比例_diff']
+    holders_diff = latest_df['總股東數_diff']
+
+    flagged = latest_df.copy()
+    flagged['訊號'] = None
+    flagged.loc[(pct_diff >= threshold) & (holders_diff < 0), '訊號'] = '鎖碼'
+    flagged.loc[(pct_diff <= -threshold) & (holders_diff > 0), '訊號'] = '渙散'
+
+    flagged = flagged[flagged['訊號'].notna()]
+    return flagged.sort_values('>1000張_比例_diff', ascending=False, key=abs)
+
+# --- 5. 集中度指標 (全 15 級距) ---
+# TDCC 持股分級 1~15 由小到大 (16: 差異數調整、17: 合計，不列入)
+DISTRIBUTION_LEVELS = list(range(1, 16))
+# 散戶: Level 1 ~ 8 (50 張以下)
+RETAIL_LEVELS = list(range(1, 9))
+
+CONCENTRATION_METRICS = ['gini', 'hhi', 'retail_pct', 'big_pct', 'retail_shares', 'big_shares']
+
+CONCENTRATION_LABELS = {
+    'gini': 'Gini',
+    'hhi': 'HHI',
+    'retail_pct': '散戶比例',
+    'big_pct': '大戶比例',
+    'retail_flow': '散戶流量(張)',
+    'big_flow': '大戶流量(張)',
+}
+
+def _level_matrix(raw_df: pd.DataFrame):
+    """轉為 (股票x週) x 級距 的人數 / 股數矩陣"""
+    df = raw_df[['stock_id', 'date', 'level', 'persons', 'shares']].copy()
+    for col in ['level', 'persons', 'shares']:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    df = df[df['level'].isin(DISTRIBUTION_LEVELS)]
+    df = df.drop_duplicates(subset=['stock_id', 'date', 'level'], keep='first')
+    df['date'] = df['date'].astype(str)
+
+    wide = df.set_index(['stock_id', 'date', 'level'])[['persons', 'shares']] \
+        .unstack('level') \
+        .sort_index()
+    persons = wide['persons'].reindex(columns=DISTRIBUTION_LEVELS).fillna(0).to_numpy(dtype=float)
+    shares = wide['shares'].reindex(columns=DISTRIBUTION_LEVELS).fillna(0).to_numpy(dtype=float)
+    return wide.index.to_frame(index=False), persons, shares
+
+def compute_concentration(raw_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    全市場集中度指標 (多檔多週一次矩陣運算)：
+    - gini: 依級距分組資料估算的持股吉尼係數 (Lorenz 曲線)
+    - hhi: 假設同級距內持股平均，估算 HHI (0 ~ 10000)
+    - retail_pct / big_pct: 散戶 (<50張) / 大戶 (>400張) 持股比例 %
+    - *_diff / *_flow: 同一檔股票與前一週相比的變化，流量以張計
+    """
+    if raw_df.empty:
+        return pd.DataFrame()
+
+    keys, persons, shares = _level_matrix(raw_df)
+    if keys.empty:
+        return pd.DataFrame()
+
+    total_persons = persons.sum(axis=1)
+    total_shares = shares.sum(axis=1)
+    valid = (total_persons > 0) & (total_shares > 0)
+    safe_persons = np.where(valid, total_persons, 1)
+    safe_shares = np.where(valid, total_shares, 1)
+
+    # Lorenz 曲線 (級距由小到大) 梯形面積
+    cum_x = np.cumsum(persons, axis=1) / safe_persons[:, None]
+    cum_y = np.cumsum(shares, axis=1) / safe_shares[:, None]
+    prev_x = np.hstack([np.zeros((len(keys), 1)), cum_x[:, :-1]])
+    prev_y = np.hstack([np.zeros((len(keys), 1)), cum_y[:, :-1]])
+    gini = 1 - ((cum_x - prev_x) * (cum_y + prev_y)).sum(axis=1)
+
+    # 每人持股 = 級距股數 / 級距人數
+    per_holder = np.divide(shares, persons, out=np.zeros_like(shares), where=persons > 0)
+    hhi = (shares * per_holder).sum(axis=1) / safe_shares ** 2 * 10000
+
+    retail_idx = [DISTRIBUTION_LEVELS.index(l) for l in RETAIL_LEVELS]
+    big_idx = [DISTRIBUTION_LEVELS.index(l) for l in BIG_HOLDER_LEVELS]
+    retail_shares = shares[:, retail_idx].sum(axis=1)
+    big_shares = shares[:, big_idx].sum(axis=1)
+
+    result = keys.assign(
+        gini=np.where(valid, gini, np.nan),
+        hhi=np.where(valid, hhi, np.nan),
+        retail_pct=np.where(valid, retail_shares / safe_shares * 100, np.nan),
+        big_pct=np.where(valid, big_shares / safe_shares * 100, np.nan),
+        retail_shares=retail_shares,
+        big_shares=big_shares,
+    )
+
+    # 週變化 (已依 stock_id, date 排序，跨股票的第一筆設為 NaN)
+    first_of_stock = result['stock_id'].ne(result['stock_id'].shift())
+    for col in ['gini', 'hhi', 'retail_pct', 'big_pct']:
+        result[f'{col}_diff'] = result[col].diff().mask(first_of_stock)
+    result['retail_flow'] = (result['retail_shares'].diff() / 1000).mask(first_of_stock)
+    result['big_flow'] = (result['big_shares'].diff() / 1000).mask(first_of_stock)
+    return result
+
+def estimate_level_flows(raw_df: pd.DataFrame) -> pd.DataFrame:
+    """各級距股數週變化 (張)，欄位為 Level 1 ~ 15；正值代表該級距淨流入"""
+    if raw_df.empty:
+        return pd.DataFrame()
+
+    keys, _, shares = _level_matrix(raw_df)
+    flows = np.vstack([np.full((1, shares.shape[1]), np.nan), np.diff(shares, axis=0)]) / 1000
+    flows[keys['stock_id'].ne(keys['stock_id'].shift()).to_numpy()] = np.nan
+
+    return pd.concat([keys, pd.DataFrame(flows, columns=DISTRIBUTION_LEVELS)], axis=1)
+
+def build_level_flows(raw_df: pd.DataFrame, stock_id: str) -> pd.DataFrame:
+    """單一個股各級距流量 (App 與快取預熱共用)，欄位 date, L1 ~ L15，由新到舊"""
+    clean_stock_id = str(stock_id).strip()
+    if raw_df.empty:
+        return pd.DataFrame()
+
+    flows = estimate_level_flows(raw_df[raw_df['stock_id'] == clean_stock_id])
+    if flows.empty:
+        return flows
+    flows = flows.drop(columns=['stock_id']).dropna()
+    flows.columns = ['date'] + [f"L{level}" for level in flows.columns[1:]]
+    return flows.sort_values('date', ascending=False, ignore_index=True)
+
+def compare_concentration(df_this: pd.DataFrame, df_last: pd.DataFrame) -> pd.DataFrame:
+    """兩期集中度快照比較 (每檔一列)，回傳指標與期間變化"""
+    if df_this.empty or df_last.empty:
+        return pd.DataFrame()
+
+    merged = pd.merge(
+        df_this[['stock_id'] + CONCENTRATION_METRICS],
+        df_last[['stock_id'] + CONCENTRATION_METRICS],
+        on='stock_id',
+        suffixes=('', '_last')
+    )
+    for col in ['gini', 'hhi', 'retail_pct', 'big_pct']:
+        merged[f'{col}_diff'] = merged[col] - merged[f'{col}_last']
+    merged['retail_flow'] = (merged['retail_shares'] - merged['retail_shares_last']) / 1000
+    merged['big_flow'] = (merged['big_shares'] - merged['big_shares_last']) / 1000
+
+    return merged[['stock_id', 'gini', 'gini_diff', 'hhi', 'hhi_diff',
+                   'retail_pct', 'retail_pct_diff', 'big_pct', 'big_pct_diff',
+                   'retail_flow', 'big_flow']]
+
+# --- 6. 圖表降採樣 ---
+def downsample_series(df: pd.DataFrame, max_points: int = 150) -> pd.DataFrame:
+    """
+    圖表用降採樣：資料點超過 max_points 時，依時間順序等分桶取平均
+    (輸入需已依日期排序並以日期為 index，各桶以最後一個日期標示)
+    """
+    if len(df) <= max_points:
+        return df
+
+    bucket = np.arange(len(df)) * max_points // len(df)
+    sampled = df.groupby(bucket).mean(numeric_only=True)
+    sampled.index = df.index.to_series().groupby(bucket).last().values
+    sampled.index.name = df.index.name
+    return sampled
+
+# --- 7. 預熱快取序列化 ---
+def frame_to_payload(df: pd.DataFrame) -> dict:
+    """DataFrame 轉為可存入 jsonb 的 payload (split 格式保留欄位順序，NaN 轉 null)"""
+    return json.loads(df.to_json(orient='split', index=False, force_ascii=False))
+
+def payload_to_frame(payload: dict) -> pd.DataFrame:
+    return pd.DataFrame(payload['data'], columns=payload['columns'])
@@ -0,0 +1,104 @@
+# 2026-10-19 17:00:00: [Perf] 批次籌碼週報產生器 - 全市場一次向量化彙總 (取代逐檔多行程)
+import os
+import sys
+import argparse
+from datetime import datetime
+from supabase import create_client, Client
+from analytics import (
+    compute_top_growth, build_market_table,
+    fetch_stock_prices_bulk, flag_chip_changes, TOP_LEVEL
+)
+from bulk_fetch import get_date_rows, fetch_market_history
+
+# --- 設定 ---
+SUPABASE_URL = (os.environ.get("SUPABASE_URL") or "").strip().rstrip("/")
+SUPABASE_KEY = (os.environ.get("SUPABASE_SERVICE_KEY") or "").strip()
+
+if not SUPABASE_URL or not SUPABASE_KEY:
+    print("❌ 錯誤: 缺少環境變數")
+    sys.exit(1)
+
+supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+# --- 輸出 ---
+def write_table(df, out_dir, name, formats):
+    for fmt in formats:
+        path = os.path.join(out_dir, f"{name}.{fmt}")
+        if fmt == "parquet":
+            df.to_parquet(path, index=False)
+        elif fmt == "csv":
+            df.to_csv(path, index=False, encoding="utf-8-sig")
+        elif fmt == "html":
+            df.to_html(path, index=False, float_format=lambda v: f"{v:,.2f}")
+        print(f"   💾 {path} ({len(df)} 筆)")
+
+def run_report(weeks, out_dir, formats, with_price, top_n, threshold):
+    print(f"🚀 [Batch Report] 任務開始: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+
+    # 1. 日期
+    date_rows = get_date_rows(supabase, limit=weeks)
+    if len(date_rows) < 2:
+        print("❌ 資料庫數據不足兩週，無法產生報表")
+        sys.exit(1)
+    dates = [row['date'] for row in date_rows]
+    print(f"📅 報表區間: {dates[-1]} ~ {dates[0]} ({len(dates)} 週)")
+
+    # 2. 撈取全市場歷史
+    print("📥 撈取全市場分級資料...")
+    raw_df = fetch_market_history(supabase, date_rows)
+    if raw_df.empty:
+        print("❌ 查無資料")
+        sys.exit(1)
+    stock_ids = sorted(raw_df['stock_id'].unique())
+    print(f"   共 {len(raw_df)} 筆 / {len(stock_ids)} 檔")
+
+    # 3. 股價 (一次批次下載)
+    price_maps = None
+    if with_price:
+        print("💹 批次下載收盤價...")
+        price_maps = fetch_stock_prices_bulk(stock_ids, dates[-1], dates[0])
+        print(f"   取得 {len(price_maps)} 檔股價")
+
+    # 4. 個股籌碼表 (全市場一次彙總)
+    print("⚙️  計算全市場籌碼表...")
+    distribution_df = build_market_table(raw_df, price_maps)
+
+    # 5. 大戶增減排行 (最新兩週)
+    level_df = raw_df[raw_df['level'] == TOP_LEVEL]
+    df_this = level_df[level_df['date'].astype(str) == str(dates[0])]
+    df_last = level_df[level_df['date'].astype(str) == str(dates[1])]
+    top_growth_df = compute_top_growth(df_this, df_last, top_n=top_n)
+
+    # 6. 籌碼異動標記 (最新一週)
+    latest_df = distribution_df[distribution_df['date'] == str(dates[0])]
+    flagged_df = flag_chip_changes(latest_df, threshold=threshold)
+
+    # 7. 寫出
+    report_dir = os.path.join(out_dir, str(dates[0]))
+    os.makedirs(report_dir, exist_ok=True)
+    print(f"📤 寫出報表至 {report_dir}...")
+    write_table(distribution_df, report_dir, "distribution", formats)
+    write_table(top_growth_df, report_dir, "top_growth", formats)
+    write_table(flagged_df, report_dir, "flagged", formats)
+
+    print(f"✅ 報表產生完成: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='全市場籌碼週報批次產生器')
+    parser.add_argument('--weeks', type=int, default=12, help='回溯週數 (預設 12)')
+    parser.add_argument('--out', type=str, default='reports', help='輸出目錄 (預設 reports)')
+    parser.add_argument('--format', type=str, nargs='+', default=['parquet'],
+                        choices=['parquet', 'csv', 'html'], help='輸出格式，可多選')
+    parser.add_argument('--no-price', action='store_true', help='略過 yfinance 股價')
+    parser.add_argument('--top', type=int, default=20, help='排行榜筆數 (預設 20)')
+    parser.add_argument('--threshold', type=float, default=0.5, help='異動標記門檻 (千張比例週增減 %%)')
+
+    args = parser.parse_args()
+    run_report(
+        weeks=args.weeks,
+        out_dir=args.out,
+        formats=args.format,
+        with_price=not args.no_price,
+        top_n=args.top,
+        threshold=args.threshold,
+    )
@@ -0,0 +1,94 @@
+# 2026-10-19 17:00:00: [Fix] 全市場分頁撈取 - 索引筆數不足時續撈，避免漏資料
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+
+PAGE_SIZE = 1000  # Supabase REST 單次回傳上限
+FETCH_THREADS = 8
+RAW_COLUMNS = "date, stock_id, level, persons, shares, percent"
+
+def get_date_rows(client, limit=None):
+    """從 equity_dates 索引取得日期清單 (由新到舊，含每週筆數供分頁使用)"""
+    query = client.table("equity_dates") \
+        .select("date, row_count") \
+        .order("date", desc=True)
+    if limit:
+        query = query.limit(limit)
+    return query.execute().data or []
+
+def fetch_page(client, query_date, offset):
+    response = client.table("equity_distribution") \
+        .select(RAW_COLUMNS) \
+        .eq("date", query_date) \
+        .order("stock_id") \
+        .order("level") \
+        .range(offset, offset + PAGE_SIZE - 1) \
+        .execute()
+    return response.data or []
+
+def fetch_market_history(client, date_rows) -> pd.DataFrame:
+    """
+    依日期索引的筆數事先切好分頁，以多執行緒並行撈取
+    索引筆數可能少於實際筆數 (例如檢核前寫入的舊資料)，最後一頁若仍為滿頁則續撈至不足一頁
+    """
+    tasks = [
+        (row['date'], offset)
+        for row in date_rows
+        for offset in range(0, row['row_count'] + 1, PAGE_SIZE)
+    ]
+    with ThreadPoolExecutor(max_workers=FETCH_THREADS) as pool:
+        pages = dict(zip(tasks, pool.map(lambda t: fetch_page(client, *t), tasks)))
+
+    last_offsets = {}
+    for query_date, offset in tasks:
+        last_offsets[query_date] = offset
+    for query_date, offset in last_offsets.items():
+        while len(pages[(query_date, offset)]) == PAGE_SIZE:
+            offset += PAGE_SIZE
+            pages[(query_date, offset)] = fetch_page(client, query_date, offset)
+
+    records = [r for page in pages.values() for r in page]
+    df = pd.DataFrame(records)
+    if not df.empty:
+        df['date'] = pd.to_datetime(df['date']).dt.date
+    return df
+
+def iter_market_batches(client, date_rows, batch_weeks=4):
+    """依日期分批撈取 (每批 batch_weeks 週)，避免一次載入全部歷史"""
+    for i in range(0, len(date_rows), batch_weeks):
+        batch = date_rows[i : i + batch_weeks]
+        yield [row['date'] for row in batch], fetch_market_history(client, batch)
+
+def fetch_all_pages(build_query) -> list:
+    """依序分頁直到回傳筆數不足一頁"""
+    records = []
+    offset = 0
+    while True:
+        page = build_query().range(offset, offset + PAGE_SIZE - 1).execute().data or []
+        records.extend(page)
+        if len(page) < PAGE_SIZE:
+            return records
+        offset += PAGE_SIZE
+
+def fetch_level_snapshot(client, query_date, level) -> pd.DataFrame:
+    """撈取特定日期、特定級距的全市場資料 (分頁)"""
+    records = fetch_all_pages(lambda: client.table("equity_distribution")
+        .select("stock_id, persons, shares, percent")
+        .eq("date", query_date)
+        .eq("level", level)
+        .order("stock_id"))
+    return pd.DataFrame(records)
+
+def fetch_stocks_history(client, stock_ids, start_date) -> pd.DataFrame:
+    """撈取多檔個股自 start_date 起的全部分級資料 (分頁)"""
+    records = fetch_all_pages(lambda: client.table("equity_distribution")
+        .select(RAW_COLUMNS)
+        .in_("stock_id", list(stock_ids))
+        .gte("date", start_date)
+        .order("stock_id")
+        .order("date", desc=True)
+        .order("level"))
+
+    df = pd.DataFrame(records)
+    if not df.empty:
+        df['date'] = pd.to_datetime(df['date']).dt.date
+    return df
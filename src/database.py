@@ -1,8 +1,10 @@
-# 2025-12-20 14:30:00: [Fix] 資料庫層 - 強制 Stock ID 篩選，防止資料混雜
+# 2026-10-19 20:00:00: [Fix] 資料庫層 - 市場快照改為分頁撈取 (避免 1000 筆上限截斷，與預熱排行榜一致)
 import os
+from datetime import datetime, timezone
 import streamlit as st
 import pandas as pd
 from supabase import create_client, Client
+from src.bulk_fetch import fetch_level_snapshot
 
 # --- 1. 連線管理 ---
 @st.cache_resource(ttl=3600)
@@ -19,94 +21,205 @@ def init_supabase() -> Client:
 
     return create_client(url, key)
 
-# --- 2. 基礎查詢 ---
-def get_latest_date():
-    """取得資料庫中最新的資料日期"""
+# --- 2. 基礎查詢 (日期索引) ---
+@st.cache_data(ttl=600)
+def get_date_index(limit: int = 1000) -> pd.DataFrame:
+    """
+    讀取 equity_dates 日期索引 (由 ETL / Reload 維護，每週一筆，預設取全部歷史；
+    既有資料的回補 SQL 見 src/utils.py build_date_index)
+    回傳欄位: date, row_count, stock_count, completeness, is_complete (由新到舊)
+    """
     client = init_supabase()
     try:
-        response = client.table("equity_distribution") \
-            .select("date") \
+        response = client.table("equity_dates") \
+            .select("date, row_count, stock_count") \
             .order("date", desc=True) \
-            .limit(1) \
+            .limit(limit) \
             .execute()
-        if response.data:
-            return response.data[0]['date']
-        return None
+        if not response.data:
+            return pd.DataFrame()
+
+        df = pd.DataFrame(response.data)
+        # 完整度: 與前後各 6 週股票檔數中位數相比，低於 95% 視為缺漏週 (避免長期上市檔數成長造成誤判)
+        median_count = df['stock_count'].rolling(window=13, center=True, min_periods=1).median()
+        df['completeness'] = (df['stock_count'] / median_count.where(median_count > 0)).fillna(0.0)
+        df['is_complete'] = df['completeness'] >= 0.95
+        return df
     except Exception as e:
-        st.error(f"查詢最新日期失敗: {e}")
+        st.error(f"查詢日期索引失敗: {e}")
+        return pd.DataFrame()
+
+def get_latest_date():
+    """取得資料庫中最新的資料日期"""
+    df_dates = get_date_index()
+    if df_dates.empty:
         return None
+    return df_dates.iloc[0]['date']
 
 def get_available_dates(limit=10):
-    """取得最近的資料日期 (使用 RPC 優化)"""
-    client = init_supabase()
-    try:
-        # 使用 RPC 呼叫我們在 SQL Editor 建立的 get_distinct_dates 函數
-        response = client.rpc("get_distinct_dates").execute()
-        if response.data:
-            dates = [item['date_value'] for item in response.data]
-            return dates[:limit]
-        return []
-    except Exception as e:
-        # 若 RPC 失敗 (可能沒建立 Function)，降級使用一般查詢 (效能較差)
-        try:
-            response = client.table("equity_distribution") \
-                .select("date") \
-                .order("date", desc=True) \
-                .limit(5000) \
-                .execute()
-            if response.data:
-                df = pd.DataFrame(response.data)
-                return sorted(df['date'].unique(), reverse=True)[:limit]
-        except:
-            pass
+    """取得最近的資料日期"""
+    df_dates = get_date_index()
+    if df_dates.empty:
         return []
+    return df_dates['date'].tolist()[:limit]
 
 # --- 3. 市場面查詢 ---
 @st.cache_data(ttl=600)
 def get_market_snapshot(query_date: str, level: int = 15) -> pd.DataFrame:
-    """撈取特定日期的全市場資料"""
+    """撈取特定日期的全市場資料 (分頁，與 warm_cache.py 預熱排行榜使用同一查詢)"""
     client = init_supabase()
     try:
-        response = client.table("equity_distribution") \
-            .select("stock_id, persons, shares, percent") \
+        return fetch_level_snapshot(client, query_date, level)
+    except Exception as e:
+        st.error(f"查詢市場快照失敗 ({query_date}): {e}")
+        return pd.DataFrame()
+
+@st.cache_data(ttl=600)
+def get_concentration_snapshot(query_date: str, stock_ids: tuple) -> pd.DataFrame:
+    """
+    撈取特定日期、指定股票的集中度指標 (equity_concentration，由 ETL 計算)
+    只查需要的股票，避免全市場查詢被 REST 單次 1000 筆上限截斷
+    """
+    client = init_supabase()
+    try:
+        response = client.table("equity_concentration") \
+            .select("stock_id, gini, hhi, retail_pct, big_pct, retail_shares, big_shares") \
             .eq("date", query_date) \
-            .eq("level", level) \
+            .in_("stock_id", list(stock_ids)) \
             .execute()
-        
+
         if response.data:
             return pd.DataFrame(response.data)
         return pd.DataFrame()
     except Exception as e:
-        st.error(f"查詢市場快照失敗 ({query_date}): {e}")
+        st.error(f"查詢集中度指標失敗 ({query_date}): {e}")
         return pd.DataFrame()
 
 # --- 4. 個股面查詢 (關鍵修復) ---
 @st.cache_data(ttl=600)
 def get_stock_raw_history(stock_id: str, limit_weeks: int = 12) -> pd.DataFrame:
     """
-    撈取單一個股歷史 (強制過濾 stock_id)
+    撈取單一個股最近 limit_weeks 週的完整分級資料 (強制過濾 stock_id)
+    起始日取自日期索引，與 warm_cache.py 預熱的區間一致 (不以筆數截斷，避免最舊一週不完整)
     """
-    client = init_supabase()
-    
     # [Fix] 強制轉字串並去除空白，防止查詢錯誤
     clean_stock_id = str(stock_id).strip()
-    
-    # 計算 Row Limit
-    row_limit = limit_weeks * 20 
+
+    df_dates = get_date_index()
+    if df_dates.empty:
+        return pd.DataFrame()
+    window = df_dates['date'].head(limit_weeks)
 
     try:
+        df = _fetch_stock_history_chunk(clean_stock_id, str(window.iloc[-1]), str(window.iloc[0]))
+        if df.empty:
+            return df
+        df['date'] = pd.to_datetime(df['date']).dt.date
+        return df
+    except Exception as e:
+        st.error(f"查詢個股歷史失敗 ({clean_stock_id}): {e}")
+        return pd.DataFrame()
+
+# --- 5. 個股長歷史查詢 (依年度分段快取) ---
+HISTORY_PAGE_SIZE = 1000  # Supabase REST 單次回傳上限
+
+def _fetch_stock_history_chunk(stock_id: str, start_date: str, end_date: str) -> pd.DataFrame:
+    """分頁撈取個股在 [start_date, end_date] 區間的全部分級資料"""
+    client = init_supabase()
+    records = []
+    offset = 0
+    while True:
         response = client.table("equity_distribution") \
-            .select("*") \
-            .eq("stock_id", clean_stock_id) \
+            .select("date, stock_id, level, persons, shares, percent") \
+            .eq("stock_id", stock_id) \
+            .gte("date", start_date) \
+            .lte("date", end_date) \
             .order("date", desc=True) \
-            .limit(row_limit) \
+            .order("level") \
+            .range(offset, offset + HISTORY_PAGE_SIZE - 1) \
             .execute()
-            
-        if response.data:
-            df = pd.DataFrame(response.data)
-            df['date'] = pd.to_datetime(df['date']).dt.date
-            return df
-        return pd.DataFrame()
+        page = response.data or []
+        records.extend(page)
+        if len(page) < HISTORY_PAGE_SIZE:
+            break
+        offset += HISTORY_PAGE_SIZE
+    return pd.DataFrame(records)
+
+@st.cache_data(ttl=86400)
+def _get_stock_closed_year(stock_id: str, year: int) -> pd.DataFrame:
+    """已結束年度資料不再變動，長效快取"""
+    return _fetch_stock_history_chunk(stock_id, f"{year}-01-01", f"{year}-12-31")
+
+@st.cache_data(ttl=600)
+def _get_stock_current_year(stock_id: str, year: int) -> pd.DataFrame:
+    """當年度資料每週更新，短效快取"""
+    return _fetch_stock_history_chunk(stock_id, f"{year}-01-01", f"{year}-12-31")
+
+def get_stock_raw_history_since(stock_id: str, start_date: str) -> pd.DataFrame:
+    """
+    撈取單一個股自 start_date 起的完整歷史
+    以年度為單位分段快取，切換 1年 / 3年 / 全部 時只補撈尚未快取的年度
+    """
+    clean_stock_id = str(stock_id).strip()
+    start = pd.to_datetime(start_date).date()
+    this_year = pd.Timestamp.today().year
+
+    try:
+        chunks = [
+            _get_stock_current_year(clean_stock_id, year) if year >= this_year
+            else _get_stock_closed_year(clean_stock_id, year)
+            for year in range(start.year, this_year + 1)
+        ]
     except Exception as e:
         st.error(f"查詢個股歷史失敗 ({clean_stock_id}): {e}")
         return pd.DataFrame()
+
+    chunks = [c for c in chunks if not c.empty]
+    if not chunks:
+        return pd.DataFrame()
+
+    df = pd.concat(chunks, ignore_index=True)
+    df['date'] = pd.to_datetime(df['date']).dt.date
+    return df[df['date'] >= start].reset_index(drop=True)
+
+# --- 6. 預熱快取與瀏覽紀錄 ---
+@st.cache_data(ttl=600)
+def get_warm_entry(kind: str, cache_key: str):
+    """
+    讀取 warm_cache 預先計算的結果 (由 warm_cache.py 於 ETL 後寫入)，查無回傳 None
+
+    warm_cache 表結構:
+        kind text, cache_key text, payload jsonb, data_date date, updated_at timestamptz,
+        primary key (kind, cache_key)
+    """
+    client = init_supabase()
+    try:
+        response = client.table("warm_cache") \
+            .select("payload, data_date") \
+            .eq("kind", kind) \
+            .eq("cache_key", cache_key) \
+            .limit(1) \
+            .execute()
+        if response.data:
+            return response.data[0]
+        return None
+    except Exception:
+        # 預熱快取僅為加速，失敗時由呼叫端即時計算
+        return None
+
+def record_stock_view(stock_id: str):
+    """
+    記錄個股瀏覽 (access_log)，供預熱排程挑選熱門股；失敗不影響頁面
+
+    access_log 表結構:
+        id bigint generated always as identity primary key, stock_id text not null,
+        viewed_at timestamptz not null default now()
+    """
+    client = init_supabase()
+    try:
+        client.table("access_log").insert({
+            "stock_id": str(stock_id).strip(),
+            "viewed_at": datetime.now(timezone.utc).isoformat(),
+        }).execute()
+    except Exception:
+        pass
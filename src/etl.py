@@ -1,10 +1,13 @@
-# 2024-12-16 22:10:00: [Refactor] 引入 utils 模組，簡化 ETL 流程
+# 2026-10-19 20:30:00: [Refactor] ETL 主表寫入改用 utils 共用函式 (NaN 轉 null)
 import os
 import sys
 import requests
 from datetime import datetime
 from supabase import create_client, Client
-from utils import clean_and_transform_data  # 引入共用模組
+from utils import (  # 引入共用模組
+    clean_and_transform_data, validate_distribution, to_json_records, upsert_in_batches,
+    write_date_index, write_concentration, write_quarantine, BATCH_SIZE
+)
 
 # --- 設定 ---
 TDCC_URL = "https://smart.tdcc.com.tw/opendata/getOD.ashx?id=1-5"
@@ -59,25 +62,53 @@ def run_etl():
         print(f"❌ 清洗失敗: {e}")
         sys.exit(1)
 
+    # 3-1. 完整性檢核 (重複級距修復，異常股票整組隔離)
+    print("🔎 完整性檢核...")
+    try:
+        df, quarantine_df, summary = validate_distribution(df)
+    except Exception as e:
+        print(f"❌ 檢核失敗: {e}")
+        sys.exit(1)
+    print(f"   檢核 {summary['groups']} 組，修復重複級距 {summary['repaired']} 組，隔離 {summary['quarantined'] or 0}")
+    if not quarantine_df.empty:
+        try:
+            print(f"   ⚠️ 已寫入隔離表: {write_quarantine(supabase, quarantine_df)} 筆")
+        except Exception as e:
+            print(f"⚠️ 隔離資料寫入失敗: {e}")
+
     # 4. 寫入 DB
     print("📤 寫入資料庫...")
-    records = df.to_dict(orient='records')
-    BATCH_SIZE = 1000
+    records = to_json_records(df)
     total_inserted = 0
     
     try:
-        for i in range(0, len(records), BATCH_SIZE):
-            batch = records[i : i + BATCH_SIZE]
-            supabase.table("equity_distribution").upsert(batch).execute()
-            total_inserted += len(batch)
-            if (i // BATCH_SIZE) % 10 == 0:
-                 print(f"   已寫入: {total_inserted} / {len(records)}")
-            
-        print("✅ ETL 任務成功完成！")
+        # 每 10 批回報一次進度
+        for i in range(0, len(records), BATCH_SIZE * 10):
+            chunk = records[i : i + BATCH_SIZE * 10]
+            upsert_in_batches(supabase, "equity_distribution", chunk)
+            total_inserted += len(chunk)
+            print(f"   已寫入: {total_inserted} / {len(records)}")
 
     except Exception as e:
         print(f"❌ 寫入失敗: {e}")
         sys.exit(1)
 
+    # 5. 更新日期索引 (App 讀取日期清單用)
+    print("🗂️  更新日期索引...")
+    try:
+        print(f"   ✅ 索引更新完成: {write_date_index(supabase, df)}")
+    except Exception as e:
+        print(f"❌ 索引更新失敗: {e}")
+        sys.exit(1)
+
+    # 6. 集中度指標 (全級距，供 App 排行榜與 AI 分析使用)
+    print("📐 計算集中度指標...")
+    try:
+        print(f"   ✅ 集中度指標寫入完成: {write_concentration(supabase, df)} 檔")
+    except Exception as e:
+        print(f"⚠️ 集中度指標寫入失敗: {e}")
+
+    print("✅ ETL 任務成功完成！")
+
 if __name__ == "__main__":
     run_etl()
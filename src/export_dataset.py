@@ -0,0 +1,137 @@
+# 2026-10-19 12:00:00: [Feat] 全歷史欄式匯出工具 (Parquet / Arrow IPC，增量追加新週次)
+import os
+import sys
+import argparse
+from datetime import datetime
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from supabase import create_client, Client
+from analytics import aggregate_weekly
+from bulk_fetch import get_date_rows, iter_market_batches
+
+# --- 設定 ---
+SUPABASE_URL = (os.environ.get("SUPABASE_URL") or "").strip().rstrip("/")
+SUPABASE_KEY = (os.environ.get("SUPABASE_SERVICE_KEY") or "").strip()
+
+if not SUPABASE_URL or not SUPABASE_KEY:
+    print("❌ 錯誤: 缺少環境變數")
+    sys.exit(1)
+
+supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+# 精簡欄位型態 (stock_id 以字典編碼，level 僅 1~17)
+RAW_SCHEMA = pa.schema([
+    ("date", pa.date32()),
+    ("stock_id", pa.dictionary(pa.int16(), pa.string())),
+    ("level", pa.int8()),
+    ("persons", pa.int32()),
+    ("shares", pa.int64()),
+    ("percent", pa.float32()),
+])
+
+WEEKLY_SCHEMA = pa.schema([
+    ("stock_id", pa.dictionary(pa.int16(), pa.string())),
+    ("date", pa.date32()),
+    ("總股東數", pa.int32()),
+    ("平均張數/人", pa.float32()),
+    (">400張_比例", pa.float32()),
+    (">400張_人數", pa.int32()),
+    (">1000張_比例", pa.float32()),
+    (">1000張_人數", pa.int32()),
+])
+
+DATASETS = {
+    "equity_distribution": RAW_SCHEMA,
+    "weekly_aggregates": WEEKLY_SCHEMA,
+}
+
+FILE_EXT = {"parquet": "parquet", "arrow": "arrow"}
+
+# --- 1. 格式轉換與寫出 ---
+def to_arrow_table(df: pd.DataFrame, schema: pa.Schema) -> pa.Table:
+    """依 schema 轉為精簡型態的 Arrow Table"""
+    df = df[schema.names].copy()
+    df['date'] = pd.to_datetime(df['date']).dt.date
+    df['stock_id'] = df['stock_id'].astype(str)
+    for field in schema:
+        if pa.types.is_integer(field.type):
+            df[field.name] = pd.to_numeric(df[field.name], errors='coerce').round().astype("Int64")
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+def write_partition(table: pa.Table, path: str, fmt: str):
+    """先寫暫存檔再改名，避免中斷時留下不完整的週次檔被視為已匯出"""
+    tmp_path = f"{path}.tmp"
+    if fmt == "parquet":
+        pq.write_table(table, tmp_path, compression="zstd")
+    else:
+        options = pa.ipc.IpcWriteOptions(compression="zstd")
+        with pa.ipc.new_file(tmp_path, table.schema, options=options) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+def exported_dates(out_dir, fmt):
+    """已完整匯出的週次 (原始資料與週彙總皆存在)"""
+    ext = FILE_EXT[fmt]
+    date_sets = []
+    for name in DATASETS:
+        dataset_dir = os.path.join(out_dir, name)
+        if not os.path.isdir(dataset_dir):
+            return set()
+        date_sets.append({
+            f[:-len(ext) - 1] for f in os.listdir(dataset_dir) if f.endswith(f".{ext}")
+        })
+    return set.intersection(*date_sets)
+
+# --- 2. 主流程 ---
+def run_export(out_dir, fmt, batch_weeks, full):
+    print(f"🚀 [Export] 任務開始: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+
+    for name in DATASETS:
+        os.makedirs(os.path.join(out_dir, name), exist_ok=True)
+
+    # 1. 比對日期索引，僅處理尚未匯出的週次
+    date_rows = get_date_rows(supabase)
+    done = set() if full else exported_dates(out_dir, fmt)
+    pending = [row for row in date_rows if str(row['date']) not in done]
+    pending.sort(key=lambda row: row['date'])
+
+    if not pending:
+        print("✅ 已是最新，無新週次需匯出")
+        return
+    print(f"📋 共 {len(date_rows)} 週，已匯出 {len(done)} 週，待匯出 {len(pending)} 週")
+
+    # 2. 依日期分批撈取 + 寫出 (每週一個檔案)
+    ext = FILE_EXT[fmt]
+    total_rows = 0
+    for batch_dates, raw_df in iter_market_batches(supabase, pending, batch_weeks=batch_weeks):
+        if raw_df.empty:
+            print(f"   ⚠️  {batch_dates[0]} ~ {batch_dates[-1]} 查無資料，略過")
+            continue
+
+        weekly_df = aggregate_weekly(raw_df)
+        for d, day_raw in raw_df.groupby('date'):
+            d_str = str(d)
+            day_weekly = weekly_df[weekly_df['date'] == d_str]
+            write_partition(
+                to_arrow_table(day_raw, RAW_SCHEMA),
+                os.path.join(out_dir, "equity_distribution", f"{d_str}.{ext}"), fmt
+            )
+            write_partition(
+                to_arrow_table(day_weekly, WEEKLY_SCHEMA),
+                os.path.join(out_dir, "weekly_aggregates", f"{d_str}.{ext}"), fmt
+            )
+        total_rows += len(raw_df)
+        print(f"   ✅ {batch_dates[0]} ~ {batch_dates[-1]}: {len(raw_df)} 筆")
+
+    print(f"✅ 匯出完成，共 {total_rows} 筆 ({out_dir})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='TDCC 全歷史欄式資料匯出工具')
+    parser.add_argument('--out', type=str, default='export', help='輸出目錄 (預設 export)')
+    parser.add_argument('--format', type=str, default='parquet', choices=['parquet', 'arrow'], help='輸出格式')
+    parser.add_argument('--batch-weeks', type=int, default=4, help='每批撈取週數 (預設 4)')
+    parser.add_argument('--full', action='store_true', help='忽略既有檔案，全部重新匯出')
+
+    args = parser.parse_args()
+    run_export(args.out, args.format, args.batch_weeks, args.full)
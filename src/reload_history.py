@@ -1,15 +1,19 @@
-# 2024-12-16 22:20:00: [Feat] 歷史重載工具 (從 Storage 恢復資料)
+# 2026-10-19 20:30:00: [Refactor] 重載主表寫入改用 utils 共用函式 (NaN 轉 null)
 import os
 import sys
 import argparse
 from datetime import datetime
 from supabase import create_client, Client
-from utils import clean_and_transform_data  # 重用清洗邏輯
+from utils import (  # 重用清洗邏輯
+    clean_and_transform_data, validate_distribution, to_json_records, upsert_in_batches,
+    write_date_index, write_concentration, write_quarantine
+)
 
 # --- 設定 ---
 SUPABASE_URL = (os.environ.get("SUPABASE_URL") or "").strip().rstrip("/")
 SUPABASE_KEY = (os.environ.get("SUPABASE_SERVICE_KEY") or "").strip()
 BUCKET_NAME = "tdcc_raw_files"
+LIST_PAGE_SIZE = 100  # Storage list 單次回傳筆數
 
 if not SUPABASE_URL or not SUPABASE_KEY:
     print("❌ 錯誤: 缺少環境變數")
@@ -38,24 +42,56 @@ def process_single_file(file_name):
         print(f"   ❌ 清洗失敗: {e}")
         return
 
+    # 2-1. 完整性檢核
+    try:
+        df, quarantine_df, summary = validate_distribution(df)
+        print(f"   🔎 檢核 {summary['groups']} 組，修復重複級距 {summary['repaired']} 組，隔離 {summary['quarantined'] or 0}")
+    except Exception as e:
+        print(f"   ❌ 檢核失敗: {e}")
+        return
+    try:
+        write_quarantine(supabase, quarantine_df)
+    except Exception as e:
+        print(f"   ❌ 隔離資料寫入失敗: {e}")
+
     # 3. 寫入
     print("   📤 正在寫入資料庫...")
-    records = df.to_dict(orient='records')
-    BATCH_SIZE = 1000
     try:
-        for i in range(0, len(records), BATCH_SIZE):
-            batch = records[i : i + BATCH_SIZE]
-            supabase.table("equity_distribution").upsert(batch).execute()
+        upsert_in_batches(supabase, "equity_distribution", to_json_records(df))
         print("   ✅ 寫入成功！")
     except Exception as e:
         print(f"   ❌ 寫入失敗: {e}")
+        return
+
+    # 4. 更新日期索引
+    try:
+        write_date_index(supabase, df)
+        print("   🗂️  日期索引已更新")
+    except Exception as e:
+        print(f"   ❌ 索引更新失敗: {e}")
+
+    # 5. 集中度指標
+    try:
+        write_concentration(supabase, df)
+        print("   📐 集中度指標已更新")
+    except Exception as e:
+        print(f"   ❌ 集中度指標寫入失敗: {e}")
 
 def list_and_process_all():
     """列出 Bucket 所有檔案並依序處理"""
     print("🔍 正在列出 Storage 所有檔案...")
     try:
-        # 注意: list 方法預設有分頁限制 (通常 100 筆)，若檔案極多需改寫為迴圈分頁
-        files = supabase.storage.from_(BUCKET_NAME).list()
+        # list 方法單次最多回傳 LIST_PAGE_SIZE 筆，需迴圈分頁
+        files = []
+        offset = 0
+        while True:
+            page = supabase.storage.from_(BUCKET_NAME).list(
+                options={"limit": LIST_PAGE_SIZE, "offset": offset, "sortBy": {"column": "name", "order": "asc"}}
+            )
+            files.extend(page)
+            if len(page) < LIST_PAGE_SIZE:
+                break
+            offset += LIST_PAGE_SIZE
         
         # 過濾出 CSV 檔
         csv_files = [f['name'] for f in files if f['name'].endswith('.csv')]
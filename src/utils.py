@@ -1,7 +1,8 @@
-# 2024-12-16 22:00:00: [Refactor] 建立共用清洗邏輯 (ETL 與 Reload 共用)
+# 2026-10-19 19:00:00: [Docs] 日期索引補上由 equity_distribution 回補的 SQL
 import pandas as pd
 import io
 import re
+from analytics import compute_concentration, CONCENTRATION_METRICS
 
 def clean_and_transform_data(raw_content: bytes) -> pd.DataFrame:
     """
@@ -64,3 +65,127 @@ def clean_and_transform_data(raw_content: bytes) -> pd.DataFrame:
     df.dropna(subset=['date', 'stock_id', 'level'], inplace=True)
     
     return df
+
+
+def build_date_index(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    日期索引彙總 (寫入 equity_dates 表，取代 get_distinct_dates RPC)：
+    每個日期一筆，記錄資料筆數 (row_count) 與股票檔數 (stock_count)
+
+    equity_dates 表結構:
+        date date primary key, row_count int, stock_count int
+
+    首次建立或索引缺漏時，直接由 equity_distribution 回補 (不依賴 Storage 原始檔):
+        insert into equity_dates (date, row_count, stock_count)
+        select date, count(*), count(distinct stock_id) from equity_distribution group by date
+        on conflict (date) do update
+            set row_count = excluded.row_count, stock_count = excluded.stock_count;
+    """
+    if df.empty:
+        return pd.DataFrame(columns=['date', 'row_count', 'stock_count'])
+
+    return df.groupby('date', as_index=False).agg(
+        row_count=('stock_id', 'size'),
+        stock_count=('stock_id', 'nunique')
+    )
+
+# --- 資料完整性檢核 ---
+# 必要級距 1~15 (16: 差異數調整、17: 合計)
+REQUIRED_LEVELS = list(range(1, 16))
+TOTAL_LEVEL = 17
+PERCENT_TOLERANCE = 1.0  # 級距比例加總與 100% 的容許誤差
+
+def validate_distribution(df: pd.DataFrame):
+    """
+    以 (stock_id, date) 分組一次檢核全部資料：
+    1. 重複級距: 保留第一筆 (修復)
+    2. 缺少級距 1~15、數值缺漏或為負、比例加總偏離 100%: 整組隔離
+    回傳: (通過資料, 隔離資料 (含 reason 欄), 摘要 dict)
+    """
+    keys = ['stock_id', 'date']
+    if df.empty:
+        return df, df.assign(reason=pd.Series(dtype=str)), {'groups': 0, 'repaired': 0, 'quarantined': {}}
+
+    # 1. 修復重複級距
+    dup_mask = df.duplicated(subset=keys + ['level'], keep='first')
+    repaired_groups = df.loc[dup_mask, keys].drop_duplicates()
+    df = df[~dup_mask]
+
+    # 2. 分組檢核 (比例加總不含合計列；數值檢核僅看必要級距，差異數調整可能為負)
+    value_cols = ['persons', 'shares', 'percent']
+    detail = df[df['level'] != TOTAL_LEVEL]
+    required = df[df['level'].isin(REQUIRED_LEVELS)]
+    bad_rows = required[value_cols].isna().any(axis=1) | (required[value_cols] < 0).any(axis=1)
+    checks = pd.DataFrame({
+        'level_count': required.groupby(keys)['level'].nunique(),
+        'percent_sum': detail.groupby(keys)['percent'].sum(),
+        'bad_values': bad_rows.groupby([required[k] for k in keys]).any(),
+    })
+    checks = checks.reindex(df[keys].drop_duplicates().set_index(keys).index)
+    checks['level_count'] = checks['level_count'].fillna(0)
+    checks['bad_values'] = checks['bad_values'].fillna(False).astype(bool)
+
+    reason = pd.Series(None, index=checks.index, dtype=object)
+    reason[(checks['percent_sum'] - 100).abs() > PERCENT_TOLERANCE] = 'percent_sum'
+    reason[checks['bad_values']] = 'bad_values'
+    reason[checks['level_count'] < len(REQUIRED_LEVELS)] = 'missing_levels'
+    reason = reason.dropna().rename('reason')
+
+    # 3. 分流
+    flagged = df.join(reason, on=keys)
+    quarantine_df = flagged[flagged['reason'].notna()]
+    valid_df = flagged[flagged['reason'].isna()].drop(columns=['reason'])
+
+    summary = {
+        'groups': len(checks),
+        'repaired': len(repaired_groups),
+        'quarantined': reason.value_counts().to_dict(),
+    }
+    return valid_df, quarantine_df, summary
+
+
+# --- 共用寫入 (ETL 與 Reload 共用) ---
+BATCH_SIZE = 1000
+
+def to_json_records(df: pd.DataFrame) -> list:
+    """DataFrame 轉為 upsert 用的 records (NaN 轉 None)"""
+    return df.astype(object).where(df.notna(), None).to_dict(orient='records')
+
+def upsert_in_batches(client, table: str, records: list, batch_size: int = BATCH_SIZE):
+    for i in range(0, len(records), batch_size):
+        client.table(table).upsert(records[i : i + batch_size]).execute()
+
+def write_date_index(client, df: pd.DataFrame) -> list:
+    """更新 equity_dates 日期索引 (表結構見 build_date_index)，回傳更新的日期"""
+    index_records = to_json_records(build_date_index(df))
+    upsert_in_batches(client, "equity_dates", index_records)
+    return [r['date'] for r in index_records]
+
+def write_concentration(client, df: pd.DataFrame) -> int:
+    """
+    計算並寫入集中度指標，回傳檔數
+
+    equity_concentration 表結構:
+        stock_id text, date date, gini float8, hhi float8, retail_pct float8, big_pct float8,
+        retail_shares float8, big_shares float8, primary key (stock_id, date)
+    """
+    conc_df = compute_concentration(df)
+    if conc_df.empty:
+        return 0
+    conc_records = to_json_records(conc_df[['stock_id', 'date'] + CONCENTRATION_METRICS])
+    upsert_in_batches(client, "equity_concentration", conc_records)
+    return len(conc_records)
+
+def write_quarantine(client, quarantine_df: pd.DataFrame) -> int:
+    """
+    寫入檢核未通過的資料 (validate_distribution 的隔離結果)，回傳筆數
+
+    equity_quarantine 表結構:
+        date date, stock_id text, level int, persons bigint, shares bigint, percent float8,
+        reason text, quarantined_at timestamptz default now(), primary key (date, stock_id, level)
+    """
+    if quarantine_df.empty:
+        return 0
+    records = to_json_records(quarantine_df[['date', 'stock_id', 'level', 'persons', 'shares', 'percent', 'reason']])
+    upsert_in_batches(client, "equity_quarantine", records)
+    return len(records)
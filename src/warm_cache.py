@@ -0,0 +1,139 @@
+# 2026-10-19 20:00:00: [Fix] ETL 後快取預熱 - 讀取失敗記錄後正常結束 (不中斷週報)，updated_at 改為 UTC
+import os
+import sys
+import argparse
+from datetime import datetime, timedelta, timezone
+import pandas as pd
+from supabase import create_client, Client
+from analytics import (
+    compute_top_growth, build_stock_table, build_level_flows, attach_price_and_diff,
+    fetch_stock_prices_bulk, frame_to_payload, TOP_LEVEL
+)
+from bulk_fetch import get_date_rows, fetch_all_pages, fetch_level_snapshot, fetch_stocks_history
+
+# --- 設定 ---
+SUPABASE_URL = (os.environ.get("SUPABASE_URL") or "").strip().rstrip("/")
+SUPABASE_KEY = (os.environ.get("SUPABASE_SERVICE_KEY") or "").strip()
+
+# 需與 App 預設值一致 (logic.WARM_TOP_N、database.get_stock_raw_history 的 12 週區間)
+TOP_N = 20
+HISTORY_WEEKS = 12
+STOCK_BATCH_SIZE = 50  # in_ 查詢每批股票數 (避免 URL 過長)
+
+if not SUPABASE_URL or not SUPABASE_KEY:
+    print("❌ 錯誤: 缺少環境變數")
+    sys.exit(1)
+
+supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+def upsert_warm(kind, cache_key, df, data_date):
+    """寫入 warm_cache (表結構見 src/database.py get_warm_entry)"""
+    supabase.table("warm_cache").upsert({
+        "kind": kind,
+        "cache_key": cache_key,
+        "payload": frame_to_payload(df),
+        "data_date": str(data_date),
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+    }).execute()
+
+def get_hot_stocks(days, limit):
+    """依 access_log 近 N 天瀏覽次數取熱門股 (分頁讀取全部紀錄，表結構見 src/database.py record_stock_view)"""
+    since = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+    try:
+        records = fetch_all_pages(lambda: supabase.table("access_log")
+            .select("stock_id")
+            .gte("viewed_at", since)
+            .order("id"))
+    except Exception as e:
+        print(f"⚠️ 讀取瀏覽紀錄失敗: {e}")
+        return []
+    if not records:
+        return []
+    counts = pd.DataFrame(records)['stock_id'].value_counts()
+    return counts.head(limit).index.tolist()
+
+def run_warm(pairs, hot_days, hot_limit):
+    print(f"🔥 [Warm Cache] 任務開始: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+
+    # 讀取失敗僅記錄並結束 (預熱僅為加速，不可中斷後續的週報步驟)
+    try:
+        date_rows = get_date_rows(supabase, limit=max(HISTORY_WEEKS, pairs + 1))
+    except Exception as e:
+        print(f"❌ 讀取日期索引失敗: {e}")
+        return
+    dates = [str(row['date']) for row in date_rows]
+    if len(dates) < 2:
+        print("❌ 資料庫數據不足兩週，略過預熱")
+        return
+    latest_date = dates[0]
+
+    # 1. 排行榜 (預設為最新一週 vs 前一週，可往前多預熱幾組)
+    print("🏆 預熱大戶增減排行榜...")
+    snapshots = {}
+    leaderboard_ids = set()
+    for i in range(min(pairs, len(dates) - 1)):
+        this_date, last_date = dates[i], dates[i + 1]
+        try:
+            for d in (this_date, last_date):
+                if d not in snapshots:
+                    snapshots[d] = fetch_level_snapshot(supabase, d, TOP_LEVEL)
+        except Exception as e:
+            print(f"   ⚠️ {this_date} vs {last_date} 讀取快照失敗: {e}")
+            continue
+        top_df = compute_top_growth(snapshots[this_date], snapshots[last_date], top_n=TOP_N)
+        if top_df.empty:
+            continue
+        if i == 0:
+            leaderboard_ids.update(top_df['股票代號'])
+        try:
+            upsert_warm("top_growth", f"{this_date}_{last_date}", top_df, latest_date)
+            print(f"   ✅ {this_date} vs {last_date}")
+        except Exception as e:
+            print(f"   ⚠️ {this_date} vs {last_date} 寫入失敗: {e}")
+
+    # 2. 熱門股 = 瀏覽紀錄前 N 名 + 最新排行榜
+    hot_ids = sorted(set(get_hot_stocks(hot_days, hot_limit)) | leaderboard_ids)
+    if not hot_ids:
+        print("✅ 無熱門個股需預熱")
+        return
+    print(f"📈 預熱 {len(hot_ids)} 檔個股籌碼表與級距流量...")
+
+    history_dates = dates[:HISTORY_WEEKS]
+    try:
+        raw_df = pd.concat([
+            fetch_stocks_history(supabase, hot_ids[i : i + STOCK_BATCH_SIZE], history_dates[-1])
+            for i in range(0, len(hot_ids), STOCK_BATCH_SIZE)
+        ], ignore_index=True)
+    except Exception as e:
+        print(f"❌ 讀取個股歷史失敗: {e}")
+        return
+    if raw_df.empty:
+        print("⚠️ 查無個股歷史資料")
+        return
+
+    # 3. 股價 (一次批次下載)
+    price_maps = fetch_stock_prices_bulk(hot_ids, history_dates[-1], history_dates[0])
+
+    # 4. 組裝並寫入
+    warmed = 0
+    for sid, stock_df in raw_df.groupby('stock_id'):
+        df_pivot = build_stock_table(stock_df, sid)
+        if df_pivot.empty:
+            continue
+        try:
+            upsert_warm("stock_table", sid, attach_price_and_diff(df_pivot, price_maps.get(sid, {})), latest_date)
+            upsert_warm("level_flows", sid, build_level_flows(stock_df, sid), latest_date)
+            warmed += 1
+        except Exception as e:
+            print(f"   ⚠️ {sid} 寫入失敗: {e}")
+
+    print(f"✅ 預熱完成: 個股 {warmed} / {len(hot_ids)} 檔")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='ETL 後快取預熱工具')
+    parser.add_argument('--pairs', type=int, default=1, help='預熱的排行榜週次組數 (預設 1: 最新 vs 前一週)')
+    parser.add_argument('--hot-days', type=int, default=30, help='熱門股統計天數 (預設 30)')
+    parser.add_argument('--hot-limit', type=int, default=50, help='熱門股檔數上限 (預設 50)')
+
+    args = parser.parse_args()
+    run_warm(args.pairs, args.hot_days, args.hot_limit)